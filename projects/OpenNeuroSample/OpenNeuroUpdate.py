@@ -15,6 +15,7 @@ class OpenNeuroUpdate(object):
         self.conf = toml.load(dataset[1])
         self.type = dataset[2]
         self.image_info = None
+        self._loaded_image = None
 
     def update_image_path(self):
         if self.type == "sub":
@@ -48,6 +49,28 @@ class OpenNeuroUpdate(object):
                 print("4D")
                 return list(image.iter_img(img))
 
+    def get_image_volume(self, sliceIndex: int = 0):
+        """
+        Get a single volume of the image, along with the number of volumes in
+        the image. The image is opened once and read lazily, so only the
+        requested volume is read from disk (quickly, for gzipped images, when
+        indexed_gzip is installed).
+        """
+        image_path = self.update_image_path()
+        if self.image_info is not None:
+            if self._loaded_image is None or self._loaded_image[0] != image_path:
+                img = nib.load(image_path, keep_file_open=True)
+                self._loaded_image = (image_path, img)
+            img = self._loaded_image[1]
+            if len(img.shape) == 3:
+                if sliceIndex != 0:
+                    raise IndexError(f"Image is 3D, index {sliceIndex} out of range")
+                return img, 1
+            if not 0 <= sliceIndex < img.shape[3]:
+                raise IndexError(f"Image has {img.shape[3]} volumes, index {sliceIndex} out of range")
+            volume = img.__class__(img.dataobj[..., sliceIndex], img.affine, img.header)
+            return volume, img.shape[3]
+
     def get_metadata(self):
         image_path = self.update_image_path()
         print(image_path.replace("nii.gz","json")) #need to modify in the future
@@ -96,7 +119,7 @@ class OpenNeuroUpdate(object):
         :param output: the output file that will go to stream
         :return: BidsIncremental
         """
-        image = self.get_image()
+        volume, num_volumes = self.get_image_volume(sliceIndex)
         conf = self.get_conf()
         subject = self.get_bids_required_info()[0]
         task = self.get_bids_required_info()[1]
@@ -115,7 +138,7 @@ class OpenNeuroUpdate(object):
         imageMetadata = {'subject': subject, 'session': self.conf['sessionId'], 'task': task,
                          'suffix': suffix, 'datatype': self.conf['dataType']}
         imageMetadata.update(metadata)
-        return (BidsIncremental(image[sliceIndex],imageMetadata, datasetMetadata),len(image))
+        return (BidsIncremental(volume,imageMetadata, datasetMetadata),num_volumes)
 
     def stream(self):
         """
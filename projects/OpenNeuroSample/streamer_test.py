@@ -6,47 +6,101 @@ production code. It has been neither rigorously tested nor particularly
 carefully designed.
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from rtCommon.bidsArchive import BidsArchive
 import time
 from projects.OpenNeuroSample.OpenNeuroProto import OpenNeuroOverview
 from projects.OpenNeuroSample.OpenNeuroUpdate import OpenNeuroUpdate
 from rtCommon.dicomToBidsService import dicomToBidsinc, dicomDirToBidsinc
 
+# Number of timepoints to build ahead of the consumer for archive-backed streams
+PREFETCH = 16
+
 class bidsStreamer():
 
     def __init__(self, dataset, datasetType, sliceIndex:int = -1):
         self.dataset = dataset
         self.index = sliceIndex
         self.type = datasetType
+        # Archive and OpenNeuro images are built on a background thread in a
+        # rolling window ahead of the current index, so that reading and
+        # slicing the NIfTI overlaps with whatever the consumer does between
+        # calls. Entries are (index, Future) pairs in increasing index order.
+        self._executor = None
+        self._pending = deque()
+        if datasetType in ('archive', 'openNeuro'):
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        # The archive query never changes between timepoints, so bind it once
+        if datasetType == 'archive':
+            # A BidsArchive's layout index can only be queried from the thread
+            # that built it, so the archive is only built on the worker thread,
+            # from the dataset's path
+            self._archive_root = dataset[0]
+            self._archive = None  # only accessed on the worker thread
+            required_metadata = dataset[1]
+            self._archive_query = dict(
+                subject= required_metadata['subject'],
+                task= required_metadata['task'],
+                suffix= required_metadata['suffix'],
+                datatype= required_metadata['datatype'],
+                run = required_metadata['run'],
+                )
 
     def get_next_image(self, index:int = 0):
         if index != 0:
             self.index = index - 1
         self.index += 1
+        if self.type in ('archive', 'openNeuro'):
+            return self._get_prefetched_image(self.index)
+        elif self.type == 'dicom':
+            return self.dataset
+        elif self.type == 'dicomDir':
+            return self.dataset[self.index]
+
+    def close(self):
+        # Drop any images built ahead that won't be used, and stop the worker
+        # thread once the image it is building (if any) is done
+        self._cancel_pending()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _cancel_pending(self):
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def _get_prefetched_image(self, index:int):
+        # A seek invalidates the window; cancel whatever hasn't started yet
+        if self._pending and self._pending[0][0] != index:
+            self._cancel_pending()
+
+        nextIndex = self._pending[-1][0] + 1 if self._pending else index
+        for i in range(nextIndex, index + PREFETCH + 1):
+            self._pending.append((i, self._executor.submit(self._load_image, i)))
+
+        _, future = self._pending.popleft()
+        return future.result()
+
+    def _load_image(self, index:int):
         if self.type == 'archive':
             NUM_TIMEPOINTS = 146  # 4th dimension of NIfTI image -- manually extracted
-            if self.index >= NUM_TIMEPOINTS:
+            if index >= NUM_TIMEPOINTS:
                 raise StopIteration
             else:
-                required_metadata = self.dataset[1]
-                return self.dataset[0].getIncremental(
-                    subject= required_metadata['subject'],
-                    task= required_metadata['task'],
-                    suffix= required_metadata['suffix'],
-                    datatype= required_metadata['datatype'],
-                    run = required_metadata['run'],
-                    sliceIndex=self.index,
-                    )
+                if self._archive is None:
+                    self._archive = BidsArchive(self._archive_root)
+                return self._archive.getIncremental(sliceIndex=index,
+                                                    **self._archive_query)
         elif self.type == 'openNeuro':
-            NUM_TIMEPOINTS = self.dataset.dataset_Bidsinc(sliceIndex=self.index)[1]
-            if self.index >= NUM_TIMEPOINTS:
+            try:
+                incremental, NUM_TIMEPOINTS = \
+                    self.dataset.dataset_Bidsinc(sliceIndex=index)
+            except IndexError:
+                # Past the last volume of the image
                 raise StopIteration
-            else:
-                return self.dataset.dataset_Bidsinc(sliceIndex=self.index)[0]
-        elif self.type == 'dicom':
-            return self.dataset
-        elif self.type == 'dicomDir':
-            return self.dataset[self.index]
+            return incremental
 
 def dicomMetadataSample() -> dict:
     sample = {}
@@ -72,19 +126,29 @@ def main(args):
         openneuroDataset.webCommunication() #  communicate with web-platform and update conf file
         openStream = bidsStreamer(openneuroDataset,'openNeuro')
         #print(openStream.get_next_image(110))
-        for i in range(10):
-            print(openStream.get_next_image())
-            time.sleep(.1)
+        try:
+            for i in range(10):
+                print(openStream.get_next_image())
+                time.sleep(.1)
+        finally:
+            openStream.close()
     # bidsArchive example
     elif args == "bidsArchive":
         path = '/Users/cocozhao/Desktop/rt-cloud-bidsinc-dev 4/projects/OpenNeuroSample/ds000102_sub4'
         required_metadata = {'subject':'04', 'task':'flanker', 'suffix':'bold', 'datatype':'func','run' : 1}
-        archiveDataset = BidsArchive(path),required_metadata
+        archiveDataset = path,required_metadata
         archivestream = bidsStreamer(archiveDataset,'archive')
         #print(archivestream.get_next_image(1))
-        for i in range(196):
-            print(archivestream.get_next_image(i))
-            time.sleep(.1)
+        # The streamer already builds upcoming images in the background, so
+        # handling each image here overlaps with building the next ones
+        try:
+            for i in range(196):
+                print(archivestream.get_next_image(i))
+                time.sleep(.1)
+        except StopIteration:
+            pass
+        finally:
+            archivestream.close()
     elif args == "dicomDir":
         dicomDir = "/Users/cocozhao/Desktop/rt-cloud-bidsinc-dev 4/projects/sample/dicomDir/20190219.0219191_faceMatching.0219191_faceMatching"
         requiredMetadata = {'subject': '01', 'task': 'faces', 'suffix': 'bold',  # REQUIRED
@@ -5,6 +5,7 @@ bidsArchive.py
 Implements interacting with an on-disk BIDS Archive.
 
 -----------------------------------------------------------------------------"""
+from collections import OrderedDict
 import functools
 import json
 import logging
@@ -28,6 +29,7 @@ import numpy as np
 
 from rtCommon.bidsCommon import (
     PYBIDS_PSEUDO_ENTITIES,
+    BidsFileExtension,
     correct3DHeaderTo4D,
     getNiftiData,
 )
@@ -45,6 +47,102 @@ bc_set_option('extension_initial_dot', True)
 
 logger = logging.getLogger(__name__)
 
+# NIfTI header fields which should not change during a continuous fMRI scanning
+# session, and so must match for two images to be append-compatible. Integer
+# codes must be exactly equal, while floating point fields may hold NaNs.
+_INT_HEADER_FIELDS_TO_MATCH = (
+    "intent_code", "dim_info", "datatype", "bitpix", "qform_code",
+    "sform_code")
+_FLOAT_HEADER_FIELDS_TO_MATCH = (
+    "intent_p1", "intent_p2", "intent_p3",
+    "slice_duration", "toffset", "scl_slope", "scl_inter",
+    "quatern_b", "quatern_c", "quatern_d",
+    "qoffset_x", "qoffset_y", "qoffset_z",
+    "srow_x", "srow_y", "srow_z")
+_HEADER_FIELDS_TO_MATCH = \
+    _INT_HEADER_FIELDS_TO_MATCH + _FLOAT_HEADER_FIELDS_TO_MATCH
+
+# Image metadata fields which should not change during a continuous fMRI
+# scanning session, and so must match for two images to be append-compatible
+_METADATA_FIELDS_TO_MATCH = (
+    "Modality", "MagneticFieldStrength", "ImagingFrequency",
+    "Manufacturer", "ManufacturersModelName",
+    "InstitutionName", "InstitutionAddress",
+    "DeviceSerialNumber", "StationName", "BodyPartExamined",
+    "PatientPosition", "EchoTime",
+    "ProcedureStepDescription", "SoftwareVersions",
+    "MRAcquisitionType", "SeriesDescription", "ProtocolName",
+    "ScanningSequence", "SequenceVariant", "ScanOptions",
+    "SequenceName", "SpacingBetweenSlices", "SliceThickness",
+    "ImageType", "RepetitionTime", "PhaseEncodingDirection",
+    "FlipAngle", "InPlanePhaseEncodingDirectionDICOM",
+    "ImageOrientationPatientDICOM", "PartialFourier")
+
+# Maximum number of loaded NIfTI images (and so open file handles) each
+# archive keeps for reuse
+_IMAGE_CACHE_SIZE = 8
+
+
+def _closeImageFile(image: nib.Nifti1Image) -> None:
+    """
+    Closes the file handle held open by an image loaded with
+    keep_file_open=True, the same way nibabel does when the image's data proxy
+    is garbage collected. The handle is reopened if the image's data is read
+    again.
+    """
+    dataobj = image.dataobj
+    if hasattr(dataobj, '_opener'):
+        dataobj._opener.close_if_mine()
+        del dataobj._opener
+
+
+@functools.lru_cache(maxsize=None)
+def _headerMatchRanges(headerDtype: np.dtype) -> Union[tuple, None]:
+    """
+    Returns slices over the raw bytes of a header with the given structured
+    dtype that cover the fields to match, with adjacent fields merged into a
+    single slice. Returns None if the dtype doesn't have all of those fields.
+    """
+    fieldRanges = []
+    for field in _HEADER_FIELDS_TO_MATCH:
+        fieldInfo = headerDtype.fields.get(field)
+        if fieldInfo is None:
+            return None
+        fieldDtype, offset = fieldInfo[:2]
+        fieldRanges.append((offset, offset + fieldDtype.itemsize))
+
+    mergedRanges = []
+    for start, stop in sorted(fieldRanges):
+        if mergedRanges and start <= mergedRanges[-1][1]:
+            mergedRanges[-1][1] = max(stop, mergedRanges[-1][1])
+        else:
+            mergedRanges.append([start, stop])
+    return tuple(slice(start, stop) for start, stop in mergedRanges)
+
+
+def _headerFieldsBitwiseEqual(header1, header2) -> bool:
+    """
+    Returns True if both headers share the same binary layout and are
+    byte-for-byte identical on all the fields to match. A False result doesn't
+    mean the headers are incompatible, only that a field-by-field comparison
+    is needed (e.g., for differently-encoded NaNs or different NIfTI versions).
+    """
+    struct1 = header1.structarr
+    struct2 = header2.structarr
+    if struct1.dtype != struct2.dtype:
+        return False
+
+    byteRanges = _headerMatchRanges(struct1.dtype)
+    if byteRanges is None:
+        return False
+
+    bytes1 = struct1.tobytes()
+    bytes2 = struct2.tobytes()
+    for byteRange in byteRanges:
+        if bytes1[byteRange] != bytes2[byteRange]:
+            return False
+    return True
+
 
 def failIfEmpty(func):
     @functools.wraps(func)
@@ -81,6 +179,11 @@ class BidsArchive:
             Sessions: 3 | Runs: 2
         """
         self.rootPath = os.path.abspath(rootPath)
+        # Recently loaded NIfTI images by absolute path, so repeated reads of
+        # the same file (e.g., streaming one volume at a time) reuse a single
+        # handle. Each entry also holds the file's stat key when it was loaded,
+        # so a file changed by anything else is loaded again.
+        self._imageCache = OrderedDict()
         # Formatting initialization logic this way enables the creation of an
         # empty BIDS archive that an incremntal can then be appended to
         try:
@@ -274,6 +377,55 @@ class BidsArchive:
         # PyBids implementation uses a SQL database to store the index, and it
         # has no public methods to cleanly and incrementally update the DB.
         self.data = BIDSLayout(self.rootPath)
+        self._clearImageCache()
+
+    def _evictImage(self, path: str) -> None:
+        """
+        Removes the image at the provided absolute path from the image cache,
+        closing its file handle.
+        """
+        cached = self._imageCache.pop(path, None)
+        if cached is not None:
+            _closeImageFile(cached[1])
+
+    def _clearImageCache(self) -> None:
+        """
+        Removes all images from the image cache, closing their file handles.
+        """
+        while self._imageCache:
+            _closeImageFile(self._imageCache.popitem()[1][1])
+
+    def _loadImage(self, path: str) -> nib.Nifti1Image:
+        """
+        Loads the NIfTI image at the provided absolute path, reusing a recently
+        loaded image for that path if the file hasn't changed since. Image data
+        is not read until it is accessed, so slicing the returned image's
+        dataobj only reads the requested part of the file.
+
+        Args:
+            path: Absolute path to the image file in the archive.
+
+        Returns:
+            NIfTI image for the file at the path.
+        """
+        fileStat = os.stat(path)
+        fileKey = (fileStat.st_mtime_ns, fileStat.st_size, fileStat.st_ino)
+
+        cached = self._imageCache.get(path)
+        if cached is not None:
+            if cached[0] == fileKey:
+                self._imageCache.move_to_end(path)
+                return cached[1]
+            self._evictImage(path)
+
+        # Keeping the file open lets repeated reads from a gzipped image
+        # reuse its index (when indexed_gzip is installed), rather than
+        # decompressing from the start of the file every time
+        image = nib.load(path, keep_file_open=True)
+        self._imageCache[path] = (fileKey, image)
+        if len(self._imageCache) > _IMAGE_CACHE_SIZE:
+            _closeImageFile(self._imageCache.popitem(last=False)[1][1])
+        return image
 
     def _addImage(self, img: nib.Nifti1Image, path: str,
                   updateLayout: bool = True) -> None:
@@ -289,10 +441,75 @@ class BidsArchive:
         """
         bids_write_to_file(path, img.to_bytes(), content_mode='binary',
                            root=self.rootPath, conflicts='overwrite')
+        self._evictImage(self.absPathFromRelPath(path))
 
         if updateLayout:
             self._updateLayout()
 
+    def _appendImageInPlace(self, archiveImg: nib.Nifti1Image,
+                            newData: np.ndarray, path: str) -> bool:
+        """
+        Appends 4-D image data to the end of an existing 4-D NIfTI file in the
+        archive, then updates the time dimension in the file's header, instead
+        of reading and rewriting the whole file. This is only possible when the
+        file is uncompressed and holds exactly the header and voxel data, the
+        data isn't scaled, and the new data has the file's dtype and spatial
+        dimensions.
+
+        Args:
+            archiveImg: Image currently in the archive at the path.
+            newData: 4-D data to append along the time dimension.
+            path: Absolute path to the image file in the archive.
+
+        Returns:
+            True if the data was appended, False if the file doesn't support
+            appending in place and must be rewritten instead.
+        """
+        if not path.endswith(BidsFileExtension.IMAGE.value):
+            return False
+        if not isinstance(archiveImg, (nib.Nifti1Image, nib.Nifti2Image)):
+            return False
+
+        archiveShape = archiveImg.shape
+        if len(archiveShape) != 4 or newData.ndim != 4 or \
+                newData.shape[:3] != archiveShape[:3]:
+            return False
+
+        dataobj = archiveImg.dataobj
+        dataDtype = archiveImg.get_data_dtype()
+        if getattr(dataobj, 'slope', None) != 1.0 or \
+                getattr(dataobj, 'inter', None) != 0.0 or \
+                newData.dtype != dataDtype:
+            return False
+
+        # Anything other than the header followed by the voxel data (e.g.,
+        # trailing bytes) means the file can't simply be extended
+        header = archiveImg.header
+        voxOffset = int(header['vox_offset'])
+        if os.path.getsize(path) != \
+                voxOffset + int(np.prod(archiveShape)) * dataDtype.itemsize:
+            return False
+
+        # NIfTI voxel data is stored in Fortran order, in the header's byte
+        # order, which get_data_dtype() accounts for
+        newBytes = np.asarray(newData, dtype=dataDtype).tobytes(order='F')
+
+        dimDtype, dimOffset = header.structarr.dtype.fields['dim'][:2]
+        dimElementDtype = dimDtype.base
+        newTimeDim = np.array(archiveShape[3] + newData.shape[3],
+                              dtype=dimElementDtype)
+
+        # Write the data before the header, so a partial write leaves a file
+        # that still reads as the original image
+        with open(path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(newBytes)
+            f.seek(dimOffset + 4 * dimElementDtype.itemsize)
+            f.write(newTimeDim.tobytes())
+
+        self._evictImage(path)
+        return True
+
     def _addMetadata(self, metadata: dict, path: str,
                      updateLayout: bool = True) -> None:
         """
@@ -445,25 +662,31 @@ class BidsArchive:
             otherwise.
 
         """
-        fieldsToMatch = ["intent_p1", "intent_p2", "intent_p3", "intent_code",
-                         "dim_info", "datatype", "bitpix",
-                         "slice_duration", "toffset", "scl_slope", "scl_inter",
-                         "qform_code", "quatern_b", "quatern_c", "quatern_d",
-                         "qoffset_x", "qoffset_y", "qoffset_z",
-                         "sform_code", "srow_x", "srow_y", "srow_z"]
-
         header1 = img1.header
         header2 = img2.header
 
-        for field in fieldsToMatch:
-            v1 = header1.get(field)
-            v2 = header2.get(field)
-
-            # Use slightly more complicated check to properly match nan values
-            if not (np.allclose(v1, v2, atol=0.0, equal_nan=True)):
-                errorMsg = (f"NIfTI headers don't match on field: {field} "
-                            f"(v1: {v1}, v2: {v2})")
-                return (False, errorMsg)
+        # Bitwise-identical fields always match, so only fall back to comparing
+        # each field individually if the fast check fails
+        if not _headerFieldsBitwiseEqual(header1, header2):
+            for field in _INT_HEADER_FIELDS_TO_MATCH:
+                v1 = header1.get(field)
+                v2 = header2.get(field)
+
+                if v1 != v2:
+                    errorMsg = (f"NIfTI headers don't match on field: {field} "
+                                f"(v1: {v1}, v2: {v2})")
+                    return (False, errorMsg)
+
+            for field in _FLOAT_HEADER_FIELDS_TO_MATCH:
+                v1 = header1.get(field)
+                v2 = header2.get(field)
+
+                # Use slightly more complicated check to properly match nan
+                # values
+                if not (np.allclose(v1, v2, atol=0.0, equal_nan=True)):
+                    errorMsg = (f"NIfTI headers don't match on field: {field} "
+                                f"(v1: {v1}, v2: {v2})")
+                    return (False, errorMsg)
 
         # Two NIfTI headers are append-compatible in 2 cases:
         # 1) Pixel dimensions are exactly equal, and dimensions are equal except
@@ -591,28 +814,17 @@ class BidsArchive:
             equivalent values, False otherwise.
 
         """
-        matchFields = ["Modality", "MagneticFieldStrength", "ImagingFrequency",
-                       "Manufacturer", "ManufacturersModelName",
-                       "InstitutionName", "InstitutionAddress",
-                       "DeviceSerialNumber", "StationName", "BodyPartExamined",
-                       "PatientPosition", "EchoTime",
-                       "ProcedureStepDescription", "SoftwareVersions",
-                       "MRAcquisitionType", "SeriesDescription", "ProtocolName",
-                       "ScanningSequence", "SequenceVariant", "ScanOptions",
-                       "SequenceName", "SpacingBetweenSlices", "SliceThickness",
-                       "ImageType", "RepetitionTime", "PhaseEncodingDirection",
-                       "FlipAngle", "InPlanePhaseEncodingDirectionDICOM",
-                       "ImageOrientationPatientDICOM", "PartialFourier"]
-
         # If a particular metadata field is not defined (i.e., 'None'), then
         # there can't be a conflict in value; thus, short-circuit and skip the
         # rest of the check if a None value is found for a field.
-        for field in matchFields:
-            value1 = meta1.get(field, None)
+        get1 = meta1.get
+        get2 = meta2.get
+        for field in _METADATA_FIELDS_TO_MATCH:
+            value1 = get1(field)
             if value1 is None:
                 continue
 
-            value2 = meta2.get(field, None)
+            value2 = get2(field)
             if value2 is None:
                 continue
 
@@ -710,31 +922,39 @@ class BidsArchive:
                     raise MetadataMismatchError(
                         "Image metadata not append compatible: " + errorMsg)
 
-            # Ensure archive image is 4D, expanding if not
-            archiveData = getNiftiData(archiveImg)
-            nDimensions = len(archiveData.shape)
-            if nDimensions == 3:
-                archiveData = np.expand_dims(archiveData, 3)
-                correct3DHeaderTo4D(archiveImg, incremental.getMetadataField(
-                    "RepetitionTime"))
-            elif nDimensions == 4:
-                pass
-            else:
+            # Ensure archive image is 4D, expanding if not. The dimensions are
+            # checked from the header so an unusable image is never read in.
+            nDimensions = len(archiveImg.shape)
+            if nDimensions not in (3, 4):
                 # RT-Cloud assumes 3D or 4D NIfTI images, other sizes have
                 # unknown interpretations
                 raise DimensionError("Expected image to have 3 or 4 dimensions "
                                      f"(got {nDimensions})")
 
+            # Extend the file on disk if possible, which avoids rewriting it.
+            # No new files are created, so the layout doesn't need updating.
+            if self._appendImageInPlace(archiveImg, incremental.imageData,
+                                        imageFile.path):
+                return True
+
+            # Read in the archive's data in its on-disk dtype
+            archiveData = getNiftiData(archiveImg)
+            if nDimensions == 3:
+                archiveData = archiveData[..., np.newaxis]
+                correct3DHeaderTo4D(archiveImg, incremental.getMetadataField(
+                    "RepetitionTime"))
+
             # Create the new, combined image to replace the old one
             # TODO(spolcyn): Replace this with Nibabel's concat_images function
             # when the dtype issue with save/load cycle is fixed
             # https://github.com/nipy/nibabel/issues/986
+            # The image constructor already updates the header's dimensions to
+            # match the new data.
             newArchiveData = np.concatenate(
-                (archiveData, getNiftiData(incremental.image)), axis=3)
+                (archiveData, incremental.imageData), axis=3)
             newImg = nib.Nifti1Image(newArchiveData,
                                      affine=archiveImg.affine,
                                      header=archiveImg.header)
-            newImg.update_header()
             self._addImage(newImg, imgPath)
             return True
 
@@ -805,7 +1025,7 @@ class BidsArchive:
 
         # Create BIDS-I
         candidate = candidates[0]
-        image = candidate.get_image()
+        image = self._loadImage(candidate.path)
 
         # Process error conditions and slice image if necessary
         nDimensions = len(image.dataobj.shape)
@@ -817,10 +1037,11 @@ class BidsArchive:
             numSlices = image.dataobj.shape[3]
 
             if sliceIndex < numSlices:
-                image = image.__class__(image.dataobj[..., sliceIndex],
-                                        affine=image.affine,
-                                        header=image.header)
-                image.update_header()
+                # Keep the slice 4-D, which BidsIncremental uses as-is
+                image = image.__class__(
+                    image.dataobj[..., sliceIndex:sliceIndex + 1],
+                    affine=image.affine,
+                    header=image.header)
             else:
                 raise IndexError(f"Image index {sliceIndex} too large for NIfTI"
                                  f" volume of length {numSlices}")
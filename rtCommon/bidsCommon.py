@@ -105,6 +105,14 @@ def getNiftiData(image: nib.Nifti1Image) -> np.ndarray:
     return np.asanyarray(image.dataobj, dtype=image.dataobj.dtype)
 
 
+# Characters stripped from DICOM field names to make them BIDS-compatible
+_NON_BIDS_FIELD_CHARS = re.compile('[^a-zA-z]')
+
+# DICOM tag of the image's raw data, (7FE0,0010) 'Pixel Data'
+DICOM_PIXEL_DATA_TAG = 0x7FE00010
+
+
+@functools.lru_cache(maxsize=4096)
 def makeDicomFieldBidsCompatible(dicomField: str) -> str:
     """
     Remove non-alphanumeric characters to make a DICOM field name
@@ -123,7 +131,7 @@ def makeDicomFieldBidsCompatible(dicomField: str) -> str:
         >>> makeDicomFieldBidsCompatible(field)
         'RepetitionTime'
     """
-    return re.compile('[^a-zA-z]').sub("", dicomField)
+    return _NON_BIDS_FIELD_CHARS.sub("", dicomField)
 
 
 # From official nifti1.h
@@ -172,14 +180,17 @@ def correct3DHeaderTo4D(image: nib.Nifti1Image, repetitionTime: int,
     logger.debug(f"Units old: {oldUnits} | Units new: {newUnits}")
 
 
+# Maximum valid values, in seconds, for time-based metadata fields
+TIME_FIELD_MAX_VALUES = (("RepetitionTime", 100), ("EchoTime", 1))
+
+
 def adjustTimeUnits(imageMetadata: dict) -> None:
     """
     Validates and converts in-place the units of various time-based metadata,
     which is stored in seconds in BIDS, but often provided using milliseconds in
     DICOM.
     """
-    fieldToMaxValue = {"RepetitionTime": 100, "EchoTime": 1}
-    for field, maxValue in fieldToMaxValue.items():
+    for field, maxValue in TIME_FIELD_MAX_VALUES:
         value = imageMetadata.get(field, None)
         if value is None:
             continue
@@ -208,14 +219,22 @@ def metadataFromProtocolName(protocolName: str) -> dict:
     if not protocolName:
         return {}
 
-    foundEntities = {}
+    # Callers commonly modify the result, so return a new dictionary each time
+    return dict(_parseProtocolName(protocolName))
+
+
+# The same protocol is usually used for every volume of a run, so the result of
+# matching every entity pattern against it is cached
+@functools.lru_cache(maxsize=128)
+def _parseProtocolName(protocolName: str) -> tuple:
+    foundEntities = []
     for entity in loadBidsEntities().values():
         result = re.search(entity.pattern, protocolName)
 
         if result is not None and len(result.groups()) == 1:
-            foundEntities[entity.name] = result.group(1)
+            foundEntities.append((entity.name, result.group(1)))
 
-    return foundEntities
+    return tuple(foundEntities)
 
 
 def getDicomMetadata(dicomImg: pydicom.dataset.Dataset, kind='all') -> dict:
@@ -242,22 +261,23 @@ def getDicomMetadata(dicomImg: pydicom.dataset.Dataset, kind='all') -> dict:
     STORE_PRIVATE = (kind == 'all' or kind == 'private')
     STORE_PUBLIC = (kind == 'all' or kind == 'public')
 
-    ignoredTags = ['Pixel Data']  # the image's raw data is not metadata
-
     for elem in dicomImg:
-        if elem.name in ignoredTags:
+        tag = elem.tag
+        # the image's raw data is not metadata
+        if tag == DICOM_PIXEL_DATA_TAG:
             continue
 
-        cleanedKey = makeDicomFieldBidsCompatible(elem.name)
         # in DICOM, public tags have even group numbers and private tags are odd
         # http://dicom.nema.org/dicom/2013/output/chtml/part05/chapter_7.html
-        value = str(elem.value)
+        # Tags are ints with the group in the upper 16 bits, so test the lowest
+        # bit of the group directly
+        if tag & 0x10000:
+            if not STORE_PRIVATE:
+                continue
+        elif not STORE_PUBLIC:
+            continue
 
-        if elem.tag.is_private:
-            if STORE_PRIVATE:
-                metadata[cleanedKey] = value
-        elif STORE_PUBLIC:
-            metadata[cleanedKey] = value
+        metadata[makeDicomFieldBidsCompatible(elem.name)] = str(elem.value)
 
     return metadata
 
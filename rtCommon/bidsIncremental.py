@@ -6,11 +6,11 @@ Implements the BIDS Incremental data type used for streaming BIDS data between
 different applications.
 
 -----------------------------------------------------------------------------"""
-from copy import deepcopy
 import json
 from operator import eq as opeq
 import os
-from typing import Any, Callable
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
 
 from bids.layout import BIDSImageFile
 from bids.layout.writing import build_path as bids_build_path
@@ -38,16 +38,54 @@ from rtCommon.bidsCommon import (
 
 logger = logging.getLogger(__name__)
 
+# Metadata fields that are stored in BIDS file names rather than in sidecar
+# metadata files
+_FILENAME_ONLY_FIELDS = frozenset(loadBidsEntities().keys()) | \
+    frozenset(PYBIDS_PSEUDO_ENTITIES)
+
+# Columns of the events file created for an incremental by default
+_EVENTS_DEFAULT_HEADERS = ['onset', 'duration', 'response_time']
+
+
+def _countDifferences(data1: np.ndarray, data2: np.ndarray) -> int:
+    """
+    Counts the elements that differ between two same-shape 4-D arrays. The
+    comparison is done one volume at a time, so only a single volume's worth
+    of boolean temporaries is allocated instead of one for the whole image.
+    """
+    return sum(int(np.count_nonzero(data1[..., t] != data2[..., t]))
+               for t in range(data1.shape[3]))
+
+
+def _copyJsonLike(value: Any) -> Any:
+    """
+    Copies JSON-like data (nested dicts and lists of immutable values). This is
+    much cheaper than deepcopy, which keeps a memo of visited objects and
+    dispatches on the type of every object it copies.
+    """
+    if isinstance(value, dict):
+        return {key: _copyJsonLike(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_copyJsonLike(item) for item in value]
+    return value
+
 
 class BidsIncremental:
-    ENTITIES = loadBidsEntities()
+    ENTITIES: Mapping = MappingProxyType(loadBidsEntities())
     REQUIRED_IMAGE_METADATA = ['subject', 'task', 'suffix', 'datatype',
                                'RepetitionTime', 'EchoTime']
+    _REQUIRED_IMAGE_METADATA_SET = frozenset(REQUIRED_IMAGE_METADATA)
+
+    # Incrementals are created at a high rate while streaming (one per TR), so
+    # avoid the memory and allocation overhead of a per-instance __dict__
+    __slots__ = ('_imgMetadata', '_cachedFileNames', '_cachedDataDirPath',
+                 '_entityKeysPresent', 'datasetMetadata', '_image',
+                 '_imageDataCache', 'readme', '_events', 'version')
 
     """
     BIDS Incremental data format suitable for streaming BIDS Archives
     """
-    def __init__(self, image: nib.Nifti1Image, imageMetadata: dict,
+    def __init__(self, image: nib.Nifti1Image, imageMetadata: Mapping,
                  datasetMetadata: dict = None):
         """
         Initializes a BIDS Incremental object with provided image and metadata.
@@ -55,7 +93,9 @@ class BidsIncremental:
         Args:
             image: NIfTI image as an NiBabel NiftiImage or PyBids BIDSImageFile
             imageMetadata: Metadata for image, which must include all variables
-                in BidsIncremental.REQUIRED_IMAGE_METADATA.
+                in BidsIncremental.REQUIRED_IMAGE_METADATA. Any mapping works
+                (e.g., a ChainMap of several sources); it is copied, not
+                modified.
             datasetMetadata: Top-level dataset metadata for the BIDS dataset
                 to be placed in a dataset_description.json. Defaults to None and
                 a default description is used.
@@ -106,24 +146,35 @@ class BidsIncremental:
         imageMetadata = self._preprocessMetadata(imageMetadata)
         self._exceptIfMissingMetadata(imageMetadata)
         self._imgMetadata = self._postprocessMetadata(imageMetadata)
+        self._resetMetadataCaches()
 
         """ Store dataset metadata """
         if datasetMetadata is None:
             self.datasetMetadata = DEFAULT_DATASET_DESC
         else:
-            self.datasetMetadata = deepcopy(datasetMetadata)
+            self.datasetMetadata = _copyJsonLike(datasetMetadata)
 
         """ Validate and store image """
-        # Remove singleton dimensions
-        image = nib.funcs.squeeze_image(image)
-
         imageShape = image.header.get_data_shape()
-        if len(imageShape) < 3:
-            raise ValueError("Image must have at least 3 dimensions")
-        elif len(imageShape) == 3:
-            newData = np.expand_dims(getNiftiData(image), -1)
-            image = image.__class__(newData, image.affine, image.header)
+        if len(imageShape) == 4 and imageShape[3] == 1:
+            # A single volume that is already 4-D (e.g., one TR sliced out of an
+            # archive) is used directly, instead of being squeezed to 3-D and
+            # then re-expanded to 4-D
+            image = image.__class__(getNiftiData(image), image.affine,
+                                    image.header)
             correct3DHeaderTo4D(image, self._imgMetadata['RepetitionTime'])
+        else:
+            # Remove singleton dimensions
+            image = nib.funcs.squeeze_image(image)
+
+            imageShape = image.header.get_data_shape()
+            if len(imageShape) < 3:
+                raise ValueError("Image must have at least 3 dimensions")
+            elif len(imageShape) == 3:
+                newData = np.expand_dims(getNiftiData(image), -1)
+                image = image.__class__(newData, image.affine, image.header)
+                correct3DHeaderTo4D(image,
+                                    self._imgMetadata['RepetitionTime'])
 
         assert len(image.header.get_data_shape()) == 4
 
@@ -132,9 +183,9 @@ class BidsIncremental:
         # Configure README
         self.readme = "Generated BIDS-Incremental Dataset from RT-Cloud"
 
-        # Configure events file
-        eventDefaultHeaders = ['onset', 'duration', 'response_time']
-        self.events = pd.DataFrame(columns=eventDefaultHeaders)
+        # Configure events file; most streamed incrementals never use it, so an
+        # empty one is only created on first access
+        self._events = None
 
         # BIDS-I version for serialization
         self.version = 1
@@ -152,55 +203,73 @@ class BidsIncremental:
             difference = symmetricDictDifference(d1, d2, equal)
             logger.debug(valueName + " difference: %s", difference)
 
+        # Explaining a mismatch can cost far more than detecting it (e.g.,
+        # diffing full headers or counting differing voxels), so only do that
+        # work when someone will see the result
+        reportDifferences = logger.isEnabledFor(logging.DEBUG)
+
         # Compare image headers
         if self.image.header != other.image.header:
-            reportDifference("Image headers",
-                             dict(self.image.header),
-                             dict(other.image.header),
-                             np.array_equal)
+            if reportDifferences:
+                reportDifference("Image headers",
+                                 dict(self.image.header),
+                                 dict(other.image.header),
+                                 np.array_equal)
             return False
 
         # Compare image metadata
         if self._imgMetadata != other._imgMetadata:
-            reportDifference("Image metadata",
-                             self._imgMetadata,
-                             other._imgMetadata,
-                             np.array_equal)
-            return False
-
-        # Compare full image data
-        if not np.array_equal(self.imageData, other.imageData):
-            differences = self.imageData != other.imageData
-            logger.debug("Image data didn't match")
-            logger.debug("Difference count: %d (%f%%)",
-                         np.sum(differences),
-                         np.sum(differences) / np.size(differences) * 100.0)
+            if reportDifferences:
+                reportDifference("Image metadata",
+                                 self._imgMetadata,
+                                 other._imgMetadata,
+                                 np.array_equal)
             return False
 
         # Compare dataset metadata
         if self.datasetMetadata != other.datasetMetadata:
-            reportDifference("Dataset metadata",
-                             self.datasetMetadata,
-                             other.datasetMetadata)
+            if reportDifferences:
+                reportDifference("Dataset metadata",
+                                 self.datasetMetadata,
+                                 other.datasetMetadata)
             return False
 
         if not self.readme == other.readme:
-            logger.debug(f"Readmes didn't match\nself: {self.readme}\n"
-                         f"other: {other.readme}")
+            logger.debug("Readmes didn't match\nself: %s\nother: %s",
+                         self.readme, other.readme)
             return False
 
-        if not pd.DataFrame.equals(self.events, other.events):
-            logger.debug(f"Events file didn't match\n"
-                         f"self: {self.events}\n"
-                         f"other: {other.events}")
+        eventsUsed = self._events is not None or other._events is not None
+        if eventsUsed and not pd.DataFrame.equals(self.events, other.events):
+            logger.debug("Events file didn't match\nself: %s\nother: %s",
+                         self.events, other.events)
+            return False
+
+        # Compare full image data last, as it requires a pass over the entire
+        # volume
+        selfData = self.imageData
+        otherData = other.imageData
+        if not np.array_equal(selfData, otherData):
+            if reportDifferences:
+                differenceCount = _countDifferences(selfData, otherData)
+                logger.debug("Image data didn't match")
+                logger.debug("Difference count: %d (%f%%)",
+                             differenceCount,
+                             differenceCount / selfData.size * 100.0)
             return False
 
         return True
 
     def __getstate__(self):
-        # Use a shallow copy of __dict__ to avoid modifying the actual
-        # Incremental object during serialization.
-        state = self.__dict__.copy()
+        # Keep the same state keys as earlier versions of this class, which
+        # stored attributes in __dict__, so serialized incrementals can still be
+        # exchanged with peers running that code. Derived values (file names,
+        # decoded image data) aren't included, and are re-created on demand.
+        state = {'_imgMetadata': self._imgMetadata,
+                 'datasetMetadata': self.datasetMetadata,
+                 'readme': self.readme,
+                 'events': self.events,
+                 'version': self.version}
 
         # Serialize NIfTI image using class-specific method, and store its
         # specific NIfTI1/NIfTI2 class object for deserialization
@@ -210,14 +279,21 @@ class BidsIncremental:
         return state
 
     def __setstate__(self, state):
-        self.__dict__ = state
+        self._imgMetadata = state['_imgMetadata']
+        self.datasetMetadata = state['datasetMetadata']
+        self.readme = state['readme']
+        self.version = state['version']
+        self._resetMetadataCaches()
+
+        self.events = state['events']
 
+        image = state['image']
         if self.version == 1:
             # Read bytes into NIfTI object
-            self.image = self.niftiImageClass.from_bytes(self.image)
-            del self.niftiImageClass
+            image = state['niftiImageClass'].from_bytes(image)
+        self.image = image
 
-    def _preprocessMetadata(self, imageMetadata: dict) -> dict:
+    def _preprocessMetadata(self, imageMetadata: Mapping) -> dict:
         """
         Pre-process metadata to extract any additonal metadata that might be
         embedded in the provided metadata, like ProtocolName, and ensure that
@@ -235,8 +311,8 @@ class BidsIncremental:
         # Process ProtocolName
         protocolName = imageMetadata.get("ProtocolName", None)
         parsedMetadata = metadataFromProtocolName(protocolName)
-        logger.debug(f"From ProtocolName '{protocolName}', got: "
-                     f"{parsedMetadata}")
+        logger.debug("From ProtocolName '%s', got: %s", protocolName,
+                     parsedMetadata)
 
         # TODO(spolcyn): Attempt to extract the repetition time directly from
         # the NIfTI header when possible
@@ -262,7 +338,7 @@ class BidsIncremental:
 
         return parsedMetadata
 
-    def _exceptIfMissingMetadata(self, imageMetadata: dict) -> None:
+    def _exceptIfMissingMetadata(self, imageMetadata: Mapping) -> None:
         """
         Ensure that all required metadata is present.
 
@@ -272,6 +348,10 @@ class BidsIncremental:
         Raises:
             MissingMetadataError: If not all required metadata is present.
         """
+        # Only build the list of missing fields if something is missing
+        if imageMetadata.keys() >= self._REQUIRED_IMAGE_METADATA_SET:
+            return
+
         missingImageMetadata = self.findMissingImageMetadata(imageMetadata)
         if missingImageMetadata != []:
             raise MissingMetadataError(f"Image metadata missing required "
@@ -364,6 +444,15 @@ class BidsIncremental:
         """
         return len(cls.findMissingImageMetadata(imageMeta)) == 0
 
+    def _resetMetadataCaches(self) -> None:
+        """
+        Clear values derived from the image metadata (e.g., BIDS file names),
+        which must be re-computed whenever the metadata changes.
+        """
+        self._cachedFileNames = {}
+        self._cachedDataDirPath = None
+        self._entityKeysPresent = None
+
     def _exceptIfNotBids(self, entityName: str) -> None:
         """
         Raise an exception if the argument is not a valid BIDS entity
@@ -424,6 +513,7 @@ class BidsIncremental:
             self._exceptIfNotBids(field)
         if field:
             self._imgMetadata[field] = value
+            self._resetMetadataCaches()
         else:
             raise ValueError("Metadata field to set cannot be None")
 
@@ -446,6 +536,7 @@ class BidsIncremental:
         if strict:
             self._exceptIfNotBids(field)
         self._imgMetadata.pop(field, None)
+        self._resetMetadataCaches()
 
     @property
     def imageMetadata(self):
@@ -473,9 +564,32 @@ class BidsIncremental:
     def imageHeader(self):
         return self.image.header
 
+    @property
+    def image(self) -> nib.Nifti1Image:
+        return self._image
+
+    @image.setter
+    def image(self, image: nib.Nifti1Image) -> None:
+        self._image = image
+        self._imageDataCache = None
+
+    @property
+    def events(self) -> pd.DataFrame:
+        if self._events is None:
+            self._events = pd.DataFrame(columns=_EVENTS_DEFAULT_HEADERS)
+        return self._events
+
+    @events.setter
+    def events(self, events: pd.DataFrame) -> None:
+        self._events = events
+
     @property
     def imageData(self) -> np.ndarray:
-        return getNiftiData(self.image)
+        # Materializing the data from a file-backed image is expensive, so it is
+        # done once and reused until the image is replaced
+        if self._imageDataCache is None:
+            self._imageDataCache = getNiftiData(self.image)
+        return self._imageDataCache
 
     """
     BEGIN BIDS-I ARCHIVE EMULTATION API
@@ -502,16 +616,30 @@ class BidsIncremental:
         Return:
             Filename from metadata according to BIDS standard 1.4.1.
         """
-        entities = {key: self._imgMetadata[key] for key in self.ENTITIES.keys()
-                    if self._imgMetadata.get(key, None) is not None}
+        # Building the path through PyBids is relatively expensive, so names are
+        # cached until the metadata changes
+        cachedName = self._cachedFileNames.get(extension)
+        if cachedName is not None:
+            return cachedName
+
+        metadata = self._imgMetadata
+        if self._entityKeysPresent is None:
+            self._entityKeysPresent = tuple(
+                key for key in self.ENTITIES.keys()
+                if metadata.get(key, None) is not None)
+
+        entities = {key: metadata[key] for key in self._entityKeysPresent}
 
         entities["extension"] = extension.value
         if extension == BidsFileExtension.EVENTS:
             entities["suffix"] = "events"
         else:
-            entities["suffix"] = self._imgMetadata["suffix"]
+            entities["suffix"] = metadata["suffix"]
+
+        fileName = bids_build_path(entities, BIDS_FILE_PATTERN)
+        self._cachedFileNames[extension] = fileName
 
-        return bids_build_path(entities, BIDS_FILE_PATTERN)
+        return fileName
 
     @property
     def datasetName(self) -> str:
@@ -555,7 +683,10 @@ class BidsIncremental:
             >>> print(bidsi.dataDirPath)
             sub-01/ses-2011/anat
         """
-        return bids_build_path(self._imgMetadata, BIDS_DIR_PATH_PATTERN)
+        if self._cachedDataDirPath is None:
+            self._cachedDataDirPath = bids_build_path(self._imgMetadata,
+                                                      BIDS_DIR_PATH_PATTERN)
+        return self._cachedDataDirPath
 
     def writeToDisk(self, datasetRoot: str) -> None:
         """
@@ -590,9 +721,9 @@ class BidsIncremental:
 
         # Write out image metadata
         with open(metadataPath, mode='w') as metadataFile:
-            metadataToWrite = {key: self._imgMetadata[key] for key in
-                               self._imgMetadata if key not in self.ENTITIES and
-                               key not in PYBIDS_PSEUDO_ENTITIES}
+            metadataToWrite = {key: value for key, value in
+                               self._imgMetadata.items()
+                               if key not in _FILENAME_ONLY_FIELDS}
             json.dump(metadataToWrite, metadataFile, sort_keys=True, indent=4)
 
         with open(eventsPath, mode='w') as eventsFile:
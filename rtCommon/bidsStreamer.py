@@ -6,7 +6,9 @@ production code. It has been neither rigorously tested nor particularly
 carefully designed.
 """
 import os
+from bids.exceptions import NoMatchError
 from rtCommon.bidsArchive import BidsArchive
+from rtCommon.errors import StateError
 import time
 from projects.OpenNeuroSample.OpenNeuroProto import OpenNeuroOverview
 from projects.OpenNeuroSample.OpenNeuroUpdate import OpenNeuroUpdate
@@ -20,9 +22,56 @@ class bidsStreamer():
         self.metadata = requiredMetadata
         self.datasetName = datasetName
         self.path = os.path.join(path, datasetName)
-        self.dataset = BidsArchive(path) # the default dataset
         self.index = sliceIndex
         self.type = datasetType
+        # Indexing an archive is slow, so it's loaded once and then only
+        # reloaded if the dataset's files or sidecars change
+        self._archive = None
+        self._archive_signature = None
+        self._openneuro_update = None
+        # Set once the dataset is known to be unavailable as a local archive,
+        # so later calls go straight to OpenNeuroUpdate
+        self._use_openneuro_update = False
+        if self.type in ('archive', 'openNeuro'):
+            self.dataset = None # loaded on first use
+        else:
+            self.dataset = BidsArchive(path) # the default dataset
+
+    def _dataset_signature(self) -> frozenset:
+        """
+        Returns the relative path of every file in this stream's dataset, along
+        with the modification time of its JSON and TSV sidecars. These are what
+        the archive's index is built from; images are only indexed by path, and
+        the archive itself reloads an image whose file has changed, so images
+        growing by a volume at a time don't require re-indexing.
+        """
+        signature = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            # Hidden directories (e.g., .git) aren't part of the dataset
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(file_path, self.path)
+                if filename.endswith(('.json', '.tsv')):
+                    signature.append((rel_path,
+                                      os.stat(file_path).st_mtime_ns))
+                else:
+                    signature.append((rel_path, None))
+        return frozenset(signature)
+
+    def _get_archive(self) -> BidsArchive:
+        """
+        Returns the archive for this stream's dataset, re-indexing it only if
+        files were added to or removed from the dataset, or any of its sidecars
+        were modified, since it was last loaded.
+        """
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(self.path)
+        signature = self._dataset_signature()
+        if self._archive is None or signature != self._archive_signature:
+            self._archive = BidsArchive(self.path)
+            self._archive_signature = signature
+        return self._archive
 
     def get_next_image(self, definedIndex:int = 0):
         if definedIndex != 0:
@@ -30,24 +79,29 @@ class bidsStreamer():
         self.index += 1
         if self.type == 'archive':
             required_metadata = self.metadata
-            self.dataset = BidsArchive(self.path)
+            self.dataset = self._get_archive()
             return self.dataset.getIncremental(
                     sliceIndex=self.index,
                     **required_metadata
                     )
 
         elif self.type == 'openNeuro':
-            try:
-                self.dataset = BidsArchive(self.path)
-                required_metadata = self.metadata
-                return self.dataset.getIncremental(
-                    sliceIndex=self.index,
-                    **required_metadata
-                )
-            except:
-                input = self.path,self.metadata, "sub"
-                self.dataset = OpenNeuroUpdate(input)
-                return self.dataset.dataset_Bidsinc(sliceIndex=self.index)[0]
+            if not self._use_openneuro_update:
+                try:
+                    self.dataset = self._get_archive()
+                    required_metadata = self.metadata
+                    return self.dataset.getIncremental(
+                        sliceIndex=self.index,
+                        **required_metadata
+                    )
+                except (FileNotFoundError, StateError, NoMatchError):
+                    # No local archive, an empty one, or one without the
+                    # requested images
+                    input = self.path,self.metadata, "sub"
+                    self._openneuro_update = OpenNeuroUpdate(input)
+                    self._use_openneuro_update = True
+            self.dataset = self._openneuro_update
+            return self.dataset.dataset_Bidsinc(sliceIndex=self.index)[0]
         elif self.type == 'dicom':
             return self.dataset
         elif self.type == 'dicomDir':
@@ -5,21 +5,25 @@ dicomToBidsService.py
 Eventually, this will implement conversion between DICOM and BIDS.
 
 -----------------------------------------------------------------------------"""
-from nibabel.pydicom_compat import pydicom
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
 
 from rtCommon.bidsCommon import getDicomMetadata
 from rtCommon.bidsIncremental import BidsIncremental
-from rtCommon.imageHandling import convertDicomImgToNifti, readDicomFromFile
+from rtCommon.imageHandling import convertDicomFileToNiftiImg, readDicomFromFile
 
 
 def dicomToBidsinc(dicomFile, requiredMetadata: {},datasetMetadata:{}) -> BidsIncremental:
     # TODO(spolcyn): Do this all in memory -- dicom2nifti is promising
     # Put extra metadata in sidecar JSON file
-    # Currently, there are 4 disk operations:
-    # 1) Read DICOM (by dcm2niix)
-    # 2) Write NIfTI
+    # Currently, there are 3 disk operations:
+    # 1) Read DICOM (for metadata)
+    # 2) Read DICOM and write NIfTI (by dcm2niix)
     # 3) Read NIfTI
-    # 4) Read DICOM (for metadata)
+    # The DICOM file is already on disk, so it's handed to dcm2niix directly
+    # rather than written back out from the in-memory copy first.
 
     # NOTE: This is not the final version of this method.
     # The conversion from DICOM to BIDS-I and gathering all required metadata
@@ -27,20 +31,26 @@ def dicomToBidsinc(dicomFile, requiredMetadata: {},datasetMetadata:{}) -> BidsIn
     # for BIDS in it by default. Thus, another component will handle the logic
     # and error handling surrounding this.
     dicomImg = readDicomFromFile(dicomFile)
-    niftiImage = convertDicomImgToNifti(dicomImg)
+    niftiImage = convertDicomFileToNiftiImg(dicomFile)
     #logger.debug("Nifti header after conversion is: %s", niftiImage.header)
-    publicMeta, privateMeta = getDicomMetadata(dicomImg)
-    publicMeta.update(privateMeta)  # combine metadata dictionaries
-    publicMeta.update(requiredMetadata)
-    return BidsIncremental(niftiImage,publicMeta, datasetMetadata)
+    dicomMetadata = getDicomMetadata(dicomImg, kind='all')
+    # Required metadata takes precedence over the DICOM's; BidsIncremental
+    # makes its own copy, so there's no need to merge them here
+    metadata = ChainMap(requiredMetadata, dicomMetadata)
+    return BidsIncremental(niftiImage, metadata, datasetMetadata)
 
 def dicomDirToBidsinc(dicomDir, TR, requiredMetadata:{},datasetMetadata:{}):
-    bidsinc_list = []
     scan = "13" # need to include in requiredMetadata or use different dicom filename format
-    for i in range(TR+1):
-        subject = requiredMetadata['subject'].zfill(3)
-        scanNum = scan.zfill(6)
-        num = str(i).zfill(6)
-        dicomFile = dicomDir + "/" + "{}_{}_{}.dcm".format(subject, scanNum, num)
-        bidsinc_list.append(dicomToBidsinc(dicomFile,requiredMetadata,datasetMetadata))
+    # Only the TR number changes between files
+    prefix = f"{dicomDir}/{requiredMetadata['subject'].zfill(3)}_{scan.zfill(6)}_"
+    dicomFiles = [f"{prefix}{i:06d}.dcm" for i in range(TR+1)]
+
+    # Each DICOM converts independently, and most of the time is spent waiting
+    # on the disk and on dcm2niix, so convert several at once. Results keep
+    # the order of the DICOM files.
+    convert = functools.partial(dicomToBidsinc,
+                                requiredMetadata=requiredMetadata,
+                                datasetMetadata=datasetMetadata)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        bidsinc_list = list(executor.map(convert, dicomFiles))
     return bidsinc_list
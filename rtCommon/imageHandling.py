@@ -293,26 +293,28 @@ def readNifti(niftiFilename, memCached=True):
     return niftiImg
 
 
+def convertDicomFileToNiftiImg(dicomFilename):
+    '''
+    Given a dicom file already on disk, convert it to an in-memory niftiImg.
+    Unlike convertDicomImgToNifti, this doesn't need to write the dicom data
+    back out to a tmp file first, so it saves a disk write per conversion.
+    '''
+    niftiFilename = os.path.join('/tmp', 'tmp_nifti_' + uuid.uuid4().hex + '.nii')
+    convertDicomFileToNifti(dicomFilename, niftiFilename)
+    # readNifti loads the data fully into memory, so the tmp file can be removed
+    niftiImg = readNifti(niftiFilename)
+    os.remove(niftiFilename)
+    return niftiImg
+
+
 def convertDicomImgToNifti(dicomImg, dicomFilename=None):
     '''
     Given an in-memory dicomImg, convert it to an in-memory niftiImg
-    Note: due to how nibabel niftiImage works, it is just a pointer to a file
-          on disk, so we can't delete the niftiFile while niftiImage is
-          is in use.
     '''
     if dicomFilename is None:
         dicomFilename = os.path.join('/tmp', 'tmp_nifti_' + uuid.uuid4().hex + '.dcm')
     writeDicomFile(dicomImg, dicomFilename)
-    # swap .dcm extension with .nii extension
-    base, ext = os.path.splitext(dicomFilename)
-    assert ext == '.dcm'
-    niftiFilename = base + '.nii'
-    # concvert dicom file to nifti file
-    convertDicomFileToNifti(dicomFilename, niftiFilename)
-    niftiImg = readNifti(niftiFilename)
-    # cleanup the tmp files created
+    niftiImg = convertDicomFileToNiftiImg(dicomFilename)
+    # cleanup the tmp file created
     os.remove(dicomFilename)
-    # A nibabel nifti object is just a reference to a file on disk, 
-    #   so we can't delete the tmp file yet
-    os.remove(niftiFilename)
     return niftiImg
@@ -4,7 +4,6 @@ Instantiates both the web interface and an RPC server for handling client script
 """
 import os
 import sys
-import time
 import argparse
 import threading
 import logging
@@ -14,7 +13,7 @@ sys.path.append(rootPath)
 from rtCommon.webServer import Web
 from rtCommon.structDict import StructDict
 from rtCommon.utils import installLoggers
-from rtCommon.errors import InvocationError
+from rtCommon.errors import InvocationError, StateError
 from rtCommon.projectServerRPC import startRPCThread, ProjectRPCService, RPCHandlers
 from rtCommon.webSocketHandlers import DataWebSocketHandler, RejectWebSocketHandler
 
@@ -54,8 +53,8 @@ class ProjectServer:
         webThread.setDaemon(True)
         webThread.start()
         # wait for the web to initialize
-        while Web.started is False:
-            time.sleep(0.1)
+        if not Web.startedEvent.wait(timeout=30):
+            raise StateError('Web server failed to start')
         self.web = web
 
         # Make the websocket RPC handlers that will forward rpyc requests to the 
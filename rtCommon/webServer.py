@@ -40,6 +40,8 @@ class Web():
     app = None
     httpServer = None
     started = False
+    # Set once the server is listening, for threads waiting on it to start
+    startedEvent = threading.Event()
     httpPort = 8888
     # Main html page to load
     webDir = os.path.join(rootDir, 'web/')
@@ -113,6 +115,7 @@ class Web():
         Web.httpServer = tornado.httpserver.HTTPServer(Web.app, ssl_options=ssl_ctx)
         Web.httpServer.listen(Web.httpPort)
         Web.started = True
+        Web.startedEvent.set()
         Web.ioLoopInst.start()
 
     @staticmethod
@@ -1,10 +1,13 @@
 # NOTE: Could modularize this further by creating a fixtures dir and importing
 # See: https://gist.github.com/peterhurford/09f7dcda0ab04b95c026c60fa49c2a68
+from collections import ChainMap
 import json
 import logging
 import os
 from pathlib import Path
 from random import randint
+from types import MappingProxyType
+from typing import Mapping
 
 from bids.layout.writing import build_path as bids_build_path
 import nibabel as nib
@@ -61,7 +64,7 @@ def pytest_configure(config) -> None:
 
 
 # Dictionary of some fields of the read-in DICOM image
-@pytest.fixture
+@pytest.fixture(scope='session')
 def dicomMetadataSample() -> dict:
     sample = {}
     sample["ContentDate"] = "20190219"
@@ -75,9 +78,10 @@ def dicomMetadataSample() -> dict:
     return sample
 
 
-# PyDicom image read in from test DICOM file
-@pytest.fixture
-def dicomImage(dicomMetadataSample) -> pydicom.dataset.Dataset:
+def readTestDicom(dicomMetadataSample: dict) -> pydicom.dataset.Dataset:
+    """
+    Read the test DICOM file, checking a sampling of its fields
+    """
     dicom = readDicomFromFile(os.path.join(os.path.dirname(__file__),
                                            test_dicomPath))
     assert dicom is not None
@@ -89,10 +93,18 @@ def dicomImage(dicomMetadataSample) -> pydicom.dataset.Dataset:
     return dicom
 
 
-# Public metadata for test DICOM file
+# PyDicom image read in from test DICOM file
 @pytest.fixture
-def dicomImageMetadata(dicomImage):
-    return getDicomMetadata(dicomImage, kind='public')
+def dicomImage(dicomMetadataSample) -> pydicom.dataset.Dataset:
+    return readTestDicom(dicomMetadataSample)
+
+
+# Read-only public metadata for test DICOM file. Built once per session, as
+# reading the test DICOM and extracting its metadata is comparatively slow.
+@pytest.fixture(scope='session')
+def dicomImageMetadata(dicomMetadataSample) -> Mapping:
+    return MappingProxyType(getDicomMetadata(
+        readTestDicom(dicomMetadataSample), kind='public'))
 
 
 """ END DICOM RELATED FIXTURES """
@@ -144,6 +156,8 @@ def imageMetadata(dicomImageMetadata):
     """
     meta = {'subject': '01', 'task': 'faces', 'suffix': 'bold', 'datatype':
             'func', 'session': '01', 'run': 1}
+    # All DICOM values are immutable, so a shallow copy is independent of the
+    # session-wide metadata
     meta.update(dicomImageMetadata)  # DICOM
     return meta
 
@@ -180,6 +194,7 @@ def archiveWithImage(image, metadata: dict, tmpdir):
     dataPath.mkdir(parents=True)
 
     filenamePrefix = bids_build_path(metadata, BIDS_FILE_PATTERN)
+    # Always write uncompressed, which is faster to write and to append to
     imagePath = Path(dataPath, filenamePrefix + '.nii')
     metadataPath = Path(dataPath, filenamePrefix + '.json')
 
@@ -210,9 +225,10 @@ def bidsArchiveMultipleRuns(tmpdir, sample4DNifti1, imageMetadata):
     adjustTimeUnits(imageMetadata)
     archive = archiveWithImage(sample4DNifti1, imageMetadata, tmpdir)
 
-    imageMetadata = imageMetadata.copy()
-    imageMetadata['run'] = int(imageMetadata['run']) + 1
-    incremental = BidsIncremental(sample4DNifti1, imageMetadata)
+    # Overlay the next run number without copying the rest of the metadata
+    nextRunMetadata = ChainMap({'run': int(imageMetadata['run']) + 1},
+                               imageMetadata)
+    incremental = BidsIncremental(sample4DNifti1, nextRunMetadata)
     archive.appendIncremental(incremental)
 
     return archive
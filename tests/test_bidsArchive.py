@@ -337,6 +337,28 @@ def testNiftiHeaderValidation(sample4DNifti1, sample3DNifti1, sample2DNifti1,
     assert not compatible
 
 
+# Test headers that aren't bitwise equal still fall back to per-field checks
+def testNiftiHeaderValidationFallback(sample4DNifti1):
+    other4D = nib.Nifti1Image(sample4DNifti1.dataobj,
+                              sample4DNifti1.affine,
+                              sample4DNifti1.header)
+
+    # NaNs with different bit patterns are still considered equal
+    sample4DNifti1.header['scl_slope'] = np.nan
+    other4D.header['scl_slope'] = -np.nan
+    compatible, _ = BidsArchive._imagesAppendCompatible(sample4DNifti1,
+                                                        other4D)
+    assert compatible
+
+    # Headers with different binary layouts are compared field by field
+    nifti2From1 = nib.Nifti2Image(sample4DNifti1.dataobj,
+                                  sample4DNifti1.affine,
+                                  sample4DNifti1.header)
+    compatible, _ = BidsArchive._imagesAppendCompatible(sample4DNifti1,
+                                                        nifti2From1)
+    assert compatible
+
+
 # Test metdata fields are correctly compared for append compatibility
 def testMetadataValidation(imageMetadata, caplog):
     metadataCopy = imageMetadata.copy()
@@ -492,6 +514,56 @@ def testSequenceAppend(bidsArchive4D, validBidsI, imageMetadata):
                              startIndex=2, endIndex=4)
 
 
+# Test appending to an uncompressed 4-D image extends the file in place
+def testAppendInPlace(bidsArchive4D, validBidsI, monkeypatch):
+    path = bidsArchive4D.getImages()[0].path
+    originalSize = os.path.getsize(path)
+
+    # Record whether each append extended the file in place or rewrote it
+    appendResults = []
+    appendImageInPlace = bidsArchive4D._appendImageInPlace
+    addImage = bidsArchive4D._addImage
+
+    def recordAppend(*args, **kwargs):
+        result = appendImageInPlace(*args, **kwargs)
+        appendResults.append(result)
+        return result
+
+    def failAddImage(*args, **kwargs):
+        raise AssertionError("Image was rewritten instead of appended to")
+
+    monkeypatch.setattr(bidsArchive4D, '_appendImageInPlace', recordAppend)
+    monkeypatch.setattr(bidsArchive4D, '_addImage', failAddImage)
+
+    incrementAcquisitionValues(validBidsI)
+    bidsArchive4D.appendIncremental(validBidsI)
+
+    assert appendResults == [True]
+    assert os.path.getsize(path) == originalSize + validBidsI.imageData.nbytes
+    assert appendDataMatches(bidsArchive4D, validBidsI, startIndex=2)
+
+    # Files with unexpected trailing data are rewritten instead
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+
+    rewrittenPaths = []
+
+    def recordAddImage(img, imgPath, *args, **kwargs):
+        rewrittenPaths.append(imgPath)
+        return addImage(img, imgPath, *args, **kwargs)
+
+    monkeypatch.setattr(bidsArchive4D, '_addImage', recordAddImage)
+
+    incrementAcquisitionValues(validBidsI)
+    bidsArchive4D.appendIncremental(validBidsI)
+
+    assert appendResults == [True, False]
+    assert len(rewrittenPaths) == 1
+    image = bidsArchive4D.getImages()[0].get_image()
+    assert image.shape[3] == 6
+    assert appendDataMatches(bidsArchive4D, validBidsI, startIndex=4)
+
+
 # Test appending a new subject (and thus creating a new directory) to a
 # non-empty BIDS Archive
 def testAppendNewSubject(bidsArchive4D, validBidsI):
@@ -544,6 +616,40 @@ def testGetIncremental(bidsArchive3D, bidsArchive4D, sample3DNifti1,
         assert incremental == reference
 
 
+# Test that loaded images are reused until the archive changes
+def testImageHandleReuse(bidsArchive4D, validBidsI):
+    path = bidsArchive4D.getImages()[0].path
+    image = bidsArchive4D._loadImage(path)
+    assert bidsArchive4D._loadImage(path) is image
+
+    incrementAcquisitionValues(validBidsI)
+    bidsArchive4D.appendIncremental(validBidsI)
+    assert bidsArchive4D._loadImage(path) is not image
+
+    # Writes made outside the archive must also invalidate the cached image
+    image = bidsArchive4D._loadImage(path)
+    nib.save(nib.Nifti1Image(image.get_fdata()[..., :1], image.affine), path)
+    reloaded = bidsArchive4D._loadImage(path)
+    assert reloaded is not image
+    assert reloaded.shape[-1] == 1
+
+
+def testImageCacheClosesEvictedHandles(bidsArchiveMultipleRuns, monkeypatch):
+    monkeypatch.setattr('rtCommon.bidsArchive._IMAGE_CACHE_SIZE', 1)
+    firstPath, secondPath = \
+        [image.path for image in bidsArchiveMultipleRuns.getImages()][:2]
+
+    first = bidsArchiveMultipleRuns._loadImage(firstPath)
+    first.dataobj[..., 0]
+    assert hasattr(first.dataobj, '_opener')
+
+    bidsArchiveMultipleRuns._loadImage(secondPath)
+    assert list(bidsArchiveMultipleRuns._imageCache) == [secondPath]
+    assert not hasattr(first.dataobj, '_opener')
+    # An evicted image still reads, reopening its file as needed
+    assert first.dataobj[..., 0].shape == first.shape[:-1]
+
+
 # Test getting incremental from BIDS archive fails when no matching images are
 # present in the archive (either 0 or too many)
 def testGetIncrementalNoMatchingImage(bidsArchive4D, bidsArchiveMultipleRuns,
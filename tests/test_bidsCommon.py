@@ -79,7 +79,16 @@ def testMetadataExtraction(dicomImage, dicomMetadataSample):
     for field, value in dicomMetadataSample.items():
         assert metadata.get(field) == str(value)
 
-    # TODO(spolcyn): Also check private keys and public keys individually
+    # Raw image data isn't metadata
+    assert 'PixelData' not in metadata
+
+    # Public and private metadata should partition all metadata
+    publicMeta = getDicomMetadata(dicomImage, kind='public')
+    privateMeta = getDicomMetadata(dicomImage, kind='private')
+    assert publicMeta.keys().isdisjoint(privateMeta.keys())
+    assert {**publicMeta, **privateMeta} == metadata
+    for field in dicomMetadataSample.keys():
+        assert field in publicMeta
 
 
 # Ensure entitity dictionary is loaded and parsed properly
@@ -120,6 +129,10 @@ def testParseProtocolName():
     for key, expectedValue in expectedValues.items():
         assert parsedValues[key] == expectedValue
 
+    # Modifying one result must not affect later results for the same name
+    parsedValues['task'] = 'modified'
+    assert metadataFromProtocolName(protocolName)['task'] == 'story'
+
 
 # Test correct Nifti data is extracted
 def testGetNiftiData(sample4DNifti1):
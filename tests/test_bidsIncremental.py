@@ -325,6 +325,17 @@ def testQueryNifti(validBidsI):
     assert np.array_equal(queriedHeader.get(FIELD), exactHeader.get(FIELD))
 
 
+# Test that image data is only materialized once, and is refreshed when the
+# underlying image is replaced
+def testImageDataCache(validBidsI, sample4DNifti1):
+    assert validBidsI.imageData is validBidsI.imageData
+
+    newData = 2 * getNiftiData(sample4DNifti1)
+    validBidsI.image = nib.Nifti1Image(newData, sample4DNifti1.affine,
+                                       header=sample4DNifti1.header)
+    assert np.array_equal(validBidsI.imageData, newData)
+
+
 # Test that constructing BIDS-compatible filenames from internal metadata
 # returns the correct filenames
 def testFilenameConstruction(validBidsI, imageMetadata):
@@ -349,6 +360,26 @@ def testArchivePathConstruction(validBidsI, imageMetadata):
         bids_build_path(imageMetadata, BIDS_DIR_PATH_PATTERN)
 
 
+# Test that cached file names and paths follow changes to the metadata
+def testPathsUpdateWithMetadata(validBidsI, imageMetadata):
+    # Populate caches
+    assert validBidsI.imageFileName is not None
+    assert validBidsI.dataDirPath is not None
+
+    newSubject = '02'
+    validBidsI.setMetadataField('subject', newSubject)
+    imageMetadata['subject'] = newSubject
+    assert validBidsI.imageFileName == \
+        bids_build_path(imageMetadata, BIDS_FILE_PATTERN) + '.nii'
+    assert validBidsI.dataDirPath == \
+        bids_build_path(imageMetadata, BIDS_DIR_PATH_PATTERN)
+
+    validBidsI.removeMetadataField('run')
+    imageMetadata.pop('run')
+    assert validBidsI.imageFileName == \
+        bids_build_path(imageMetadata, BIDS_FILE_PATTERN) + '.nii'
+
+
 # Test that writing the BIDS-I to disk returns a properly formatted BIDS archive
 # in the correct location with all the data in the BIDS-I
 def testDiskOutput(validBidsI, tmpdir):
@@ -413,3 +444,11 @@ def testSerialization(validBidsI, sample4DNifti1, imageMetadata, tmpdir):
 
     # Check there's no file mapping
     assert deserialized.image.file_map['image'].filename is None
+
+
+# Test serialized state keeps the keys BIDS-I has always used
+def testSerializedStateCompatibility(validBidsI):
+    state = validBidsI.__getstate__()
+    assert set(state.keys()) == {'_imgMetadata', 'datasetMetadata', 'image',
+                                 'readme', 'events', 'version',
+                                 'niftiImageClass'}
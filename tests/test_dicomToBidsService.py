@@ -0,0 +1,40 @@
+import numpy as np
+
+import rtCommon.imageHandling as imageHandling
+
+import rtCommon.dicomToBidsService as dicomToBidsService
+from rtCommon.bidsIncremental import BidsIncremental
+from rtCommon.imageHandling import readDicomFromFile, readNifti, convertDicomFileToNifti
+from tests.common import test_dicomPath
+
+
+# Test that a DICOM file is only read once, and never written back to disk,
+# when converting it to a BIDS-I
+def testDicomToBidsincSingleRead(tmpdir, monkeypatch):
+    readPaths = []
+
+    def countingRead(filename):
+        readPaths.append(filename)
+        return readDicomFromFile(filename)
+
+    def failWrite(dicomImg, filename):
+        raise AssertionError("DICOM was written to disk during conversion")
+
+    monkeypatch.setattr(dicomToBidsService, 'readDicomFromFile', countingRead)
+    monkeypatch.setattr(imageHandling, 'writeDicomFile', failWrite)
+
+    requiredMetadata = {'subject': '01', 'task': 'faces', 'suffix': 'bold',
+                        'datatype': 'func', 'run': 1}
+    incremental = dicomToBidsService.dicomToBidsinc(test_dicomPath,
+                                                    requiredMetadata, {})
+    assert readPaths == [test_dicomPath]
+    assert isinstance(incremental, BidsIncremental)
+    assert incremental.getMetadataField('subject') == '01'
+
+    # Image should match a direct dcm2niix conversion of the file
+    niftiPath = str(tmpdir / 'direct.nii')
+    convertDicomFileToNifti(test_dicomPath, niftiPath)
+    expected = readNifti(niftiPath)
+    assert np.array_equal(np.squeeze(incremental.imageData),
+                          np.asanyarray(expected.dataobj))
+